@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import datetime
+import importlib
+import contextlib
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Task kinds: one "row" task per input product, plus one "assemble" task per job
+# that becomes claimable once every row of that job is done
+ROW_TASK = "row"
+ASSEMBLE_TASK = "assemble"
+
+DEFAULT_QUEUE_PATH = os.path.join(os.path.dirname(__file__), "queue", "jobs.db")
+
+
+class JobBroker(ABC):
+    """Interface between the API, which enqueues jobs, and the workers that process them.
+
+    A claimed task is leased to one worker. The worker must heartbeat before the lease
+    expires, otherwise the task is handed to the next worker that calls claim(). A task
+    whose lease has expired max_attempts times fails its job.
+    """
+
+    def __init__(self, max_attempts: int = 3):
+        self.max_attempts = max_attempts
+
+    @abstractmethod
+    def create_job(self, job_id: str, file_name: str, filetype: str, rows: List[Dict]):
+        raise NotImplementedError
+
+    @abstractmethod
+    def claim(self, worker_id: str, lease_seconds: float) -> Optional[Dict]:
+        """Lease the next runnable task, or return None when there is nothing to do"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def heartbeat(self, task_id: int, worker_id: str, lease_seconds: float) -> bool:
+        """Extend a lease; returns False if the worker no longer holds it"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def complete(self, task_id: int, worker_id: str, result: Optional[Dict]) -> bool:
+        """Store a row result; returns False if the worker no longer holds the lease"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def complete_job(self, task_id: int, worker_id: str, output_file: str) -> bool:
+        """Finish an assemble task and mark its job completed"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def fail(self, task_id: int, worker_id: str, error: str) -> bool:
+        """Mark a task and its job as failed"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def job_results(self, job_id: str) -> List[Optional[Dict]]:
+        """Row results of a job in input order"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_jobs(self) -> Dict[str, Dict]:
+        raise NotImplementedError
+
+
+class SQLiteBroker(JobBroker):
+    """Job queue stored in a SQLite file.
+
+    Single host only: the API and worker processes (or containers sharing a local volume)
+    must run on the same machine, because the WAL journal relies on shared memory and does
+    not work on network filesystems. Multi-node deployments need a JOB_BROKER backed by a
+    network broker.
+    """
+
+    def __init__(self, path: str = DEFAULT_QUEUE_PATH, max_attempts: int = 3):
+        super().__init__(max_attempts)
+        self.path = path
+        queue_dir = os.path.dirname(path)
+        if queue_dir and not os.path.exists(queue_dir):
+            os.makedirs(queue_dir)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    file_name TEXT,
+                    filetype TEXT,
+                    status TEXT NOT NULL,
+                    total INTEGER NOT NULL,
+                    start_time TEXT NOT NULL,
+                    output_file TEXT,
+                    error TEXT
+                );
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL REFERENCES jobs(job_id),
+                    kind TEXT NOT NULL,
+                    row_index INTEGER,
+                    payload TEXT,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    worker_id TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    result TEXT
+                );
+                CREATE INDEX IF NOT EXISTS tasks_by_job ON tasks (job_id, kind, status);
+                CREATE INDEX IF NOT EXISTS tasks_by_status ON tasks (status, lease_expires);
+            """)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front so two workers cannot claim the same task
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def create_job(self, job_id: str, file_name: str, filetype: str, rows: List[Dict]):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO jobs (job_id, file_name, filetype, status, total, start_time) VALUES (?, ?, ?, 'pending', ?, ?)",
+                (job_id, file_name, filetype, len(rows), datetime.datetime.now().isoformat())
+            )
+            conn.executemany(
+                "INSERT INTO tasks (job_id, kind, row_index, payload) VALUES (?, ?, ?, ?)",
+                [(job_id, ROW_TASK, idx, json.dumps(row)) for idx, row in enumerate(rows)]
+            )
+            conn.execute("INSERT INTO tasks (job_id, kind) VALUES (?, ?)", (job_id, ASSEMBLE_TASK))
+
+    def claim(self, worker_id: str, lease_seconds: float) -> Optional[Dict]:
+        now = time.time()
+        with self._transaction() as conn:
+            # Give up on tasks that have already outlived max_attempts workers
+            exhausted = conn.execute(
+                "SELECT task_id, job_id, worker_id FROM tasks WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, self.max_attempts)
+            ).fetchall()
+            for task in exhausted:
+                error_msg = f"Task {task['task_id']} was abandoned by {self.max_attempts} workers, last one {task['worker_id']}"
+                logger.error(f"Job {task['job_id']}: {error_msg}")
+                conn.execute("UPDATE tasks SET status = 'failed', lease_expires = NULL WHERE task_id = ?", (task["task_id"],))
+                conn.execute("UPDATE jobs SET status = 'failed', error = ? WHERE job_id = ?", (error_msg, task["job_id"]))
+
+            task = conn.execute("""
+                SELECT t.task_id, t.job_id, t.kind, t.row_index, t.payload, t.status, t.worker_id, j.filetype
+                FROM tasks t JOIN jobs j ON j.job_id = t.job_id
+                WHERE j.status IN ('pending', 'processing')
+                  AND (t.status = 'pending' OR (t.status = 'leased' AND t.lease_expires < ?))
+                  AND (t.kind = ? OR NOT EXISTS (
+                      SELECT 1 FROM tasks r WHERE r.job_id = t.job_id AND r.kind = ? AND r.status != 'done'
+                  ))
+                ORDER BY j.start_time, t.task_id
+                LIMIT 1
+            """, (now, ROW_TASK, ROW_TASK)).fetchone()
+            if task is None:
+                return None
+
+            if task["status"] == "leased":
+                logger.warning(f"Job {task['job_id']}: Lease on task {task['task_id']} held by {task['worker_id']} expired, reassigning to {worker_id}")
+            conn.execute(
+                "UPDATE tasks SET status = 'leased', worker_id = ?, lease_expires = ?, attempts = attempts + 1 WHERE task_id = ?",
+                (worker_id, now + lease_seconds, task["task_id"])
+            )
+            conn.execute("UPDATE jobs SET status = 'processing' WHERE job_id = ? AND status = 'pending'", (task["job_id"],))
+
+        return {
+            "task_id": task["task_id"],
+            "job_id": task["job_id"],
+            "kind": task["kind"],
+            "row_index": task["row_index"],
+            "row": json.loads(task["payload"]) if task["payload"] else None,
+            "filetype": task["filetype"]
+        }
+
+    def heartbeat(self, task_id: int, worker_id: str, lease_seconds: float) -> bool:
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET lease_expires = ? WHERE task_id = ? AND worker_id = ? AND status = 'leased'",
+                (time.time() + lease_seconds, task_id, worker_id)
+            )
+            return cursor.rowcount == 1
+
+    def _finish_task(self, conn, task_id: int, worker_id: str, status: str, result: Optional[str] = None) -> bool:
+        cursor = conn.execute(
+            "UPDATE tasks SET status = ?, result = ?, lease_expires = NULL WHERE task_id = ? AND worker_id = ? AND status = 'leased'",
+            (status, result, task_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, task_id: int, worker_id: str, result: Optional[Dict]) -> bool:
+        with self._transaction() as conn:
+            return self._finish_task(conn, task_id, worker_id, "done", json.dumps(result))
+
+    def complete_job(self, task_id: int, worker_id: str, output_file: str) -> bool:
+        with self._transaction() as conn:
+            if not self._finish_task(conn, task_id, worker_id, "done"):
+                return False
+            conn.execute(
+                "UPDATE jobs SET status = 'completed', output_file = ? WHERE job_id = (SELECT job_id FROM tasks WHERE task_id = ?)",
+                (output_file, task_id)
+            )
+            return True
+
+    def fail(self, task_id: int, worker_id: str, error: str) -> bool:
+        with self._transaction() as conn:
+            if not self._finish_task(conn, task_id, worker_id, "failed"):
+                return False
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ? WHERE job_id = (SELECT job_id FROM tasks WHERE task_id = ?)",
+                (error, task_id)
+            )
+            return True
+
+    def job_results(self, job_id: str) -> List[Optional[Dict]]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT result FROM tasks WHERE job_id = ? AND kind = ? ORDER BY row_index",
+                (job_id, ROW_TASK)
+            ).fetchall()
+        return [json.loads(row["result"]) if row["result"] else None for row in rows]
+
+    _JOB_QUERY = """
+        SELECT j.*, (SELECT COUNT(*) FROM tasks t WHERE t.job_id = j.job_id AND t.kind = ? AND t.status = 'done') AS processed
+        FROM jobs j
+    """
+
+    def _job_dict(self, row) -> Dict:
+        job = {
+            "status": row["status"],
+            "processed": row["processed"],
+            "total": row["total"],
+            "start_time": row["start_time"],
+            "file_name": row["file_name"]
+        }
+        if row["output_file"]:
+            job["output_file"] = row["output_file"]
+        if row["error"]:
+            job["error"] = row["error"]
+        return job
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        with self._connect() as conn:
+            row = conn.execute(self._JOB_QUERY + " WHERE j.job_id = ?", (ROW_TASK, job_id)).fetchone()
+        return self._job_dict(row) if row else None
+
+    def list_jobs(self) -> Dict[str, Dict]:
+        with self._connect() as conn:
+            rows = conn.execute(self._JOB_QUERY + " ORDER BY j.start_time", (ROW_TASK,)).fetchall()
+        return {row["job_id"]: self._job_dict(row) for row in rows}
+
+
+def get_broker() -> JobBroker:
+    """Build the broker named by JOB_BROKER ("module:ClassName"), or the SQLite queue at JOB_QUEUE_DB"""
+    # Times a task may lose its worker before the job is failed
+    max_attempts = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+
+    broker_path = os.environ.get("JOB_BROKER")
+    if not broker_path:
+        return SQLiteBroker(os.environ.get("JOB_QUEUE_DB", DEFAULT_QUEUE_PATH), max_attempts=max_attempts)
+
+    module_name, _, class_name = broker_path.partition(":")
+    if not class_name:
+        raise Exception(f"JOB_BROKER must look like module:ClassName, got {broker_path}")
+    logger.info(f"Using job broker {broker_path}")
+    return getattr(importlib.import_module(module_name), class_name)(max_attempts=max_attempts)
@@ -10,7 +10,10 @@ import logging
 import json
 import requests
 import platform
-from fastapi import FastAPI, UploadFile, File, BackgroundTasks
+import socket
+import threading
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File
 from fastapi.responses import FileResponse, JSONResponse
 from typing import Dict, List, Optional
 from fastapi.middleware.cors import CORSMiddleware
@@ -26,10 +29,22 @@ import openpyxl
 from openpyxl.drawing.image import Image as OpenpyxlImage
 import re
 import ast
+from job_queue import get_broker, ASSEMBLE_TASK
 
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Optionally process queued jobs inside the API process (single-process development only)"""
+    if EMBEDDED_WORKER:
+        logger.warning("EMBEDDED_WORKER is enabled: this API process will also run a browser worker")
+        threading.Thread(target=run_worker, kwargs={"batch_size": 5}, daemon=True).start()
+    else:
+        logger.info("API only enqueues jobs; start worker.py processes to scrape them")
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -97,8 +112,18 @@ def updated_chromedriver(options):
         logger.error(f"Error updating chromedriver: {str(e)}")
         raise Exception(f"Error updating chromedriver: {str(e)}")
 
-# Global variables to track job status
-active_jobs: Dict[str, Dict] = {}
+# Shared job queue: the API enqueues uploads, workers (see worker.py) scrape them
+broker = get_broker()
+
+# Seconds a claimed task stays reserved for a worker without a heartbeat
+LEASE_SECONDS = float(os.environ.get("WORKER_LEASE_SECONDS", 120))
+
+# Set EMBEDDED_WORKER=1 to also run a worker thread inside the API process (single-process
+# development); otherwise scraping happens only in worker.py processes
+EMBEDDED_WORKER = os.environ.get("EMBEDDED_WORKER", "0").lower() in ("1", "true", "yes")
+
+# Must be shared between the API and the workers so finished files can be downloaded
+output_dir = os.environ.get("OUTPUT_DIR", os.path.join(os.path.dirname(__file__), "output_files"))
 
 driver_executable_path = r"D:\FinalProject\product-dashboard\backend\extras\chrome-win64\chrome-win64\chrome.exe"
 st = os.stat(driver_executable_path)
@@ -119,166 +144,200 @@ def random_sleep(min_seconds=1, max_seconds=3):
     time.sleep(sleep_time)
     return sleep_time
 
-def process_file_background(temp_file_path: str, batch_size: int = 5, job_id: str = None):
-    try:
-        logger.info(f"Starting job {job_id}: Reading file {temp_file_path}")
-        if "xlsx" in temp_file_path:
-            df = pd.read_excel(temp_file_path)
-        elif "csv" in temp_file_path:
-            df = pd.read_csv(temp_file_path)
+def process_row(row: Dict, job_id: str):
+    """Scrape a single input row and return its output record, or None when it has no product name"""
+    srno = row.get("SrNo", "NA")
+    item_code = row.get("Item Code", "NA")
+    name = row.get("Item Name")
+    
+    if not name:
+        logger.info(f"Job {job_id}: Skipping empty product name")
+        return None
+
+    # Get product info using Selenium
+    product_info = get_product_info_using_selenium(name)
+
+    # Create a flattened result dictionary with all the information
+    return {
+        "SrNo": srno,
+        "Item Code": item_code,
+        "Item Name": name,
+        "Title": product_info.get("title", ""),
+        "Composition_on_amazon.in": product_info.get("description", ""),
+        "Price": product_info.get("price", ""),
+        "Product Details as on amazon.in": product_info.get("product_details_as_on_amazon.in", ""),
+        "Image URL": product_info.get("image", ""),
+        "Image URLs": product_info.get("image_urls", []),  # List for multiple images
+        "Amazon URL": product_info.get("url", ""),
+        "Is Discontinued": product_info.get("discontinued", ""),
+        "UNSPSC Code": product_info.get("unspsc_code", ""),
+        "Product Dimensions": product_info.get("dimensions", ""),
+        "Item Weight": product_info.get("weight", ""),
+        "Manufacturer": product_info.get("manufacturer", ""),
+        "ASIN": product_info.get("asin", ""),
+        "Model Number": product_info.get("model_number", ""),
+        "Country of Origin": product_info.get("country_of_origin", ""),
+        "Date First Available": product_info.get("date_first_available", ""),
+        "Included Components": product_info.get("included_components", ""),
+        "Generic Name": product_info.get("generic_name", ""),
+        "Error": product_info.get("error", "")
+    }
+
+def save_results(results: List[Dict], job_id: str, filetype: str) -> str:
+    """Write the scraped rows of a job to the output directory and return the file path"""
+    logger.info(f"Job {job_id}: All products processed. Saving results to output")
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    output_path = os.path.join(output_dir, f"output_{job_id}.xlsx")
+    
+    if filetype == "xlsx":
+        # Save to Excel
+        df_results = pd.DataFrame(results)
+        df_results.to_excel(output_path, index=False)
         
-        total_products = len(df)
-        results = []
-        processed = 0
+        # Load workbook to add images
+        wb = openpyxl.load_workbook(output_path)
+        ws = wb.active
         
-        logger.info(f"Job {job_id}: Found {total_products} products to process")
-        active_jobs[job_id]["total"] = total_products
-
-        # Process in batches
-        for i in range(0, total_products, batch_size):
-            batch = df.iloc[i:i+batch_size]
-            batch_num = i//batch_size + 1
-            total_batches = (total_products-1)//batch_size + 1
-            logger.info(f"Job {job_id}: Processing batch {batch_num}/{total_batches}")
-            
-            for _, row in batch.iterrows():
-                srno = row.get("SrNo", "NA")
-                item_code = row.get("Item Code", "NA")
-                name = row.get("Item Name")
-                
-                if not name:
-                    logger.info(f"Job {job_id}: Skipping empty product name")
-                    processed += 1
-                    continue
-
-                # Get product info using Selenium
-                product_info = get_product_info_using_selenium(name)
-
-                # Create a flattened result dictionary with all the information
-                result = {
-                    "SrNo": srno,
-                    "Item Code": item_code,
-                    "Item Name": name,
-                    "Title": product_info.get("title", ""),
-                    "Composition_on_amazon.in": product_info.get("description", ""),
-                    "Price": product_info.get("price", ""),
-                    "Product Details as on amazon.in": product_info.get("product_details_as_on_amazon.in", ""),
-                    "Image URL": product_info.get("image", ""),
-                    "Image URLs": product_info.get("image_urls", []),  # List for multiple images
-                    "Amazon URL": product_info.get("url", ""),
-                    "Is Discontinued": product_info.get("discontinued", ""),
-                    "UNSPSC Code": product_info.get("unspsc_code", ""),
-                    "Product Dimensions": product_info.get("dimensions", ""),
-                    "Item Weight": product_info.get("weight", ""),
-                    "Manufacturer": product_info.get("manufacturer", ""),
-                    "ASIN": product_info.get("asin", ""),
-                    "Model Number": product_info.get("model_number", ""),
-                    "Country of Origin": product_info.get("country_of_origin", ""),
-                    "Date First Available": product_info.get("date_first_available", ""),
-                    "Included Components": product_info.get("included_components", ""),
-                    "Generic Name": product_info.get("generic_name", ""),
-                    "Error": product_info.get("error", "")
-                }
-                
-                results.append(result)
-                
-                processed += 1
-                active_jobs[job_id]["processed"] = processed
-                progress_pct = (processed/total_products*100)
-                logger.info(f"Job {job_id}: Progress {processed}/{total_products} ({progress_pct:.1f}%)")
-                
-                wait_time = random.uniform(10, 20)
-                logger.info(f"Job {job_id}: Waiting {wait_time:.1f} seconds before next item")
-                time.sleep(wait_time)
-            
-            if i + batch_size < total_products:
-                pause_time = random.uniform(30, 60)
-                logger.info(f"Job {job_id}: Batch {batch_num} complete. Pausing for {pause_time:.1f} seconds before next batch")
-                time.sleep(pause_time)
+        # Determine the starting column for images (after existing columns)
+        base_columns = list(df_results.columns)
+        image_start_col_idx = len(base_columns) + 1  # 1-based index for openpyxl
         
-        logger.info(f"Job {job_id}: All products processed. Saving results to output")
-        output_dir = os.path.join(os.path.dirname(__file__), "output_files")
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
+        # Define maximum number of images per product
+        max_images = 10
+        image_col_width = 20  # Width in Excel units (~pixels / 7)
+        image_row_height = 100  # Height in points (~pixels * 0.75)
         
-        output_path = os.path.join(output_dir, f"output_{job_id}.xlsx")
+        # Add headers for image columns
+        for i in range(max_images):
+            col_letter = openpyxl.utils.get_column_letter(image_start_col_idx + i)
+            ws[f"{col_letter}1"] = f"Image {i+1}"
+            ws.column_dimensions[col_letter].width = image_col_width
         
-        if temp_file_path.endswith('.xlsx'):
-            # Save to Excel
-            df_results = pd.DataFrame(results)
-            df_results.to_excel(output_path, index=False)
-            
-            # Load workbook to add images
-            wb = openpyxl.load_workbook(output_path)
-            ws = wb.active
-            
-            # Determine the starting column for images (after existing columns)
-            base_columns = list(df_results.columns)
-            image_start_col_idx = len(base_columns) + 1  # 1-based index for openpyxl
-            
-            # Define maximum number of images per product
-            max_images = 10
-            image_col_width = 20  # Width in Excel units (~pixels / 7)
-            image_row_height = 100  # Height in points (~pixels * 0.75)
-            
-            # Add headers for image columns
-            for i in range(max_images):
-                col_letter = openpyxl.utils.get_column_letter(image_start_col_idx + i)
-                ws[f"{col_letter}1"] = f"Image {i+1}"
-                ws.column_dimensions[col_letter].width = image_col_width
-            
-            # Adjust row heights for all data rows
-            for row in range(2, ws.max_row + 1):
-                ws.row_dimensions[row].height = image_row_height
-            
-            # Embed images
-            for row_idx, result in enumerate(results, start=2):
-                image_urls = result["Image URLs"]
-                if image_urls and image_urls != ["NA"]:
-                    for idx, url in enumerate(image_urls[:max_images]):  # Limit to max_images
-                        if url != "NA":
-                            image_data = download_image_in_memory(url)
-                            if image_data:
-                                try:
-                                    # Open image with PIL and resize
-                                    pil_img = PILImage.open(image_data)
-                                    # Resize to fit within cell (e.g., 120x120 pixels)
-                                    target_size = (120, 120)
-                                    pil_img.thumbnail(target_size, PILImage.Resampling.LANCZOS)
-                                    # Save to BytesIO in PNG format
-                                    img_buffer = BytesIO()
-                                    pil_img.save(img_buffer, format="PNG")
-                                    img_buffer.seek(0)
-                                    # Embed in Excel
-                                    img = OpenpyxlImage(img_buffer)
-                                    col_letter = openpyxl.utils.get_column_letter(image_start_col_idx + idx)
-                                    ws.add_image(img, f"{col_letter}{row_idx}")
-                                except Exception as e:
-                                    logger.error(f"Failed to embed image {url} for row {row_idx}, column {col_letter}: {str(e)}")
-                else:
-                    logger.info(f"Job {job_id}: No images to embed for row {row_idx}")
-            
-            wb.save(output_path)
-        elif temp_file_path.endswith('.csv'):
-            pd.DataFrame(results).to_csv(output_path.replace('.xlsx', '.csv'), index=False)
-            logger.warning(f"Job {job_id}: CSV output does not support image embedding")
-
-        active_jobs[job_id]["status"] = "completed"
-        active_jobs[job_id]["output_file"] = output_path
-        logger.info(f"Job {job_id}: Job completed successfully")
+        # Adjust row heights for all data rows
+        for row in range(2, ws.max_row + 1):
+            ws.row_dimensions[row].height = image_row_height
         
+        # Embed images
+        for row_idx, result in enumerate(results, start=2):
+            image_urls = result["Image URLs"]
+            if image_urls and image_urls != ["NA"]:
+                for idx, url in enumerate(image_urls[:max_images]):  # Limit to max_images
+                    if url != "NA":
+                        image_data = download_image_in_memory(url)
+                        if image_data:
+                            try:
+                                # Open image with PIL and resize
+                                pil_img = PILImage.open(image_data)
+                                # Resize to fit within cell (e.g., 120x120 pixels)
+                                target_size = (120, 120)
+                                pil_img.thumbnail(target_size, PILImage.Resampling.LANCZOS)
+                                # Save to BytesIO in PNG format
+                                img_buffer = BytesIO()
+                                pil_img.save(img_buffer, format="PNG")
+                                img_buffer.seek(0)
+                                # Embed in Excel
+                                img = OpenpyxlImage(img_buffer)
+                                col_letter = openpyxl.utils.get_column_letter(image_start_col_idx + idx)
+                                ws.add_image(img, f"{col_letter}{row_idx}")
+                            except Exception as e:
+                                logger.error(f"Failed to embed image {url} for row {row_idx}, column {col_letter}: {str(e)}")
+            else:
+                logger.info(f"Job {job_id}: No images to embed for row {row_idx}")
+        
+        wb.save(output_path)
+    elif filetype == "csv":
+        output_path = output_path.replace('.xlsx', '.csv')
+        pd.DataFrame(results).to_csv(output_path, index=False)
+        logger.warning(f"Job {job_id}: CSV output does not support image embedding")
+
+    return output_path
+
+def keep_lease_alive(task_id: int, worker_id: str, lease_seconds: float, stop: threading.Event):
+    """Heartbeat a claimed task so other workers don't take it over while the browser is busy"""
+    while not stop.wait(lease_seconds / 3):
+        try:
+            if not broker.heartbeat(task_id, worker_id, lease_seconds):
+                logger.warning(f"Worker {worker_id}: Lost lease on task {task_id}")
+                return
+        except Exception as e:
+            logger.error(f"Worker {worker_id}: Heartbeat for task {task_id} failed: {str(e)}")
+
+def run_task(task: Dict, worker_id: str, lease_seconds: float) -> bool:
+    """Process one claimed task while heartbeating its lease; returns True if a product was scraped"""
+    job_id = task["job_id"]
+    stop_heartbeat = threading.Event()
+    heartbeat = threading.Thread(
+        target=keep_lease_alive,
+        args=(task["task_id"], worker_id, lease_seconds, stop_heartbeat),
+        daemon=True
+    )
+    heartbeat.start()
+    try:
+        if task["kind"] == ASSEMBLE_TASK:
+            results = [result for result in broker.job_results(job_id) if result is not None]
+            output_path = save_results(results, job_id, task["filetype"])
+            if broker.complete_job(task["task_id"], worker_id, output_path):
+                logger.info(f"Job {job_id}: Job completed successfully")
+            else:
+                logger.warning(f"Job {job_id}: Lease on assemble task lost, another worker will redo it")
+            return False
+
+        logger.info(f"Job {job_id}: Worker {worker_id} processing row {task['row_index'] + 1}")
+        result = process_row(task["row"], job_id)
+        if not broker.complete(task["task_id"], worker_id, result):
+            logger.warning(f"Job {job_id}: Lease on row {task['row_index'] + 1} lost, discarding result")
+            return False
     except Exception as e:
-        error_msg = f"Error processing Excel: {str(e)}"
-        logger.error(f"{error_msg}")
-        active_jobs[job_id]["status"] = "failed"
-        active_jobs[job_id]["error"] = error_msg
+        if task["kind"] == ASSEMBLE_TASK:
+            error_msg = f"Saving results failed: {str(e)}"
+        else:
+            error_msg = f"Row {task['row_index'] + 1} failed: {str(e)}"
+        logger.error(f"Job {job_id}: {error_msg}")
+        broker.fail(task["task_id"], worker_id, error_msg)
+        return False
     finally:
-        # Clean up the temporary file
+        stop_heartbeat.set()
+        heartbeat.join()
+
+    job = broker.get_job(job_id)
+    if job and job["total"] > 0:
+        progress_pct = (job["processed"]/job["total"]*100)
+        logger.info(f"Job {job_id}: Progress {job['processed']}/{job['total']} ({progress_pct:.1f}%)")
+
+    return result is not None
+
+def run_worker(worker_id: str = None, batch_size: int = 5, lease_seconds: float = LEASE_SECONDS, poll_interval: float = 5):
+    """Pull tasks from the shared job queue and process them until the process is stopped"""
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:4]}"
+    logger.info(f"Worker {worker_id}: Started, polling for work every {poll_interval}s")
+    scraped = 0
+
+    while True:
+        # Queue errors (e.g. "database is locked" under contention) must not kill the worker;
+        # an unfinished task's lease simply expires and it is claimed again
         try:
-            os.unlink(temp_file_path)
-            logger.info(f"Job {job_id}: Temporary file cleaned up")
+            task = broker.claim(worker_id, lease_seconds)
+            if task is None:
+                time.sleep(poll_interval)
+                continue
+            if not run_task(task, worker_id, lease_seconds):
+                continue
         except Exception as e:
-            logger.error(f"Job {job_id}: Failed to cleanup temporary file: {str(e)}")
+            logger.error(f"Worker {worker_id}: Queue error: {str(e)}")
+            time.sleep(poll_interval)
+            continue
+
+        scraped += 1
+        if scraped % batch_size == 0:
+            pause_time = random.uniform(30, 60)
+            logger.info(f"Worker {worker_id}: Batch of {batch_size} complete. Pausing for {pause_time:.1f} seconds before next batch")
+            time.sleep(pause_time)
+        else:
+            wait_time = random.uniform(10, 20)
+            logger.info(f"Worker {worker_id}: Waiting {wait_time:.1f} seconds before next item")
+            time.sleep(wait_time)
 
 def get_product_info_using_selenium(item_name: str, retry_count: int = 0):
     """Get detailed product information using Selenium with retry mechanism"""
@@ -569,7 +628,7 @@ def download_image_in_memory(image_url: str) -> Optional[BytesIO]:
 
 
 @app.post("/upload/")
-async def upload_file(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+def upload_file(file: UploadFile = File(...)):
     """Upload Excel/CSV file with product names for processing"""
     filetype = ""
     try:
@@ -578,30 +637,23 @@ async def upload_file(background_tasks: BackgroundTasks, file: UploadFile = File
         if not filetype:
             return JSONResponse(status_code=400, content={"error": "Unsupported file type"})
 
-        # Create a temporary file to store the uploaded content
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{filetype}') as temp_file:
-            # Write the file content to the temporary file
-            content = await file.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
+        # Plain def handlers run in FastAPI's threadpool, so parsing and the
+        # queue's SQLite calls don't block the event loop
+        content = file.file.read()
+        if filetype == "xlsx":
+            df = pd.read_excel(BytesIO(content))
+        else:
+            df = pd.read_csv(BytesIO(content))
+        # Round-trip through JSON so rows can be stored in the queue (NaN becomes None)
+        rows = json.loads(df.to_json(orient="records", date_format="iso"))
         
         # Generate a job ID
         job_id = uuid.uuid4().hex[:8]
         
-        # Initialize job status
-        active_jobs[job_id] = {
-            "status": "processing",
-            "processed": 0,
-            "total": 0,
-            "start_time": datetime.datetime.now().isoformat(),
-            "file_name": file.filename
-        }
+        # Enqueue one task per row for the workers
+        broker.create_job(job_id, file.filename, filetype, rows)
 
-        logger.info(f"Active jobs: {active_jobs}")
-        logger.info(f"New job created: {job_id} for file {file.filename}")
-        
-        # Start processing in background
-        background_tasks.add_task(process_file_background, temp_file_path, batch_size=5, job_id=job_id)
+        logger.info(f"New job created: {job_id} for file {file.filename} with {len(rows)} products")
         
         return {
             "job_id": job_id, 
@@ -613,13 +665,12 @@ async def upload_file(background_tasks: BackgroundTasks, file: UploadFile = File
         return JSONResponse(status_code=500, content={"error": error_msg})
 
 @app.get("/status/{job_id}")
-async def get_job_status(job_id: str):
+def get_job_status(job_id: str):
     """Check the status of a processing job"""
-    if job_id not in active_jobs:
+    job_info = broker.get_job(job_id)
+    if job_info is None:
         return JSONResponse(status_code=404, content={"error": "Job not found"})
     
-    job_info = active_jobs[job_id].copy()
-    
     # Calculate and add progress percentage
     if job_info["total"] > 0:
         job_info["progress_percentage"] = round((job_info["processed"] / job_info["total"]) * 100, 1)
@@ -635,12 +686,12 @@ async def get_job_status(job_id: str):
     return job_info
 
 @app.get("/download/{job_id}")
-async def download_results(job_id: str):
+def download_results(job_id: str):
     """Download the results of a completed job"""
-    if job_id not in active_jobs:
+    job = broker.get_job(job_id)
+    if job is None:
         return JSONResponse(status_code=404, content={"error": "Job not found"})
     
-    job = active_jobs[job_id]
     if job["status"] != "completed":
         return JSONResponse(
             status_code=400, 
@@ -657,13 +708,13 @@ async def download_results(job_id: str):
         return JSONResponse(status_code=404, content={"error": "Output file not found"})
     
     logger.info(f"Sending results file for job {job_id}: {output_file}")
-    return FileResponse(output_file, filename=f"amazon_results_{job_id}.xlsx")
+    return FileResponse(output_file, filename=f"amazon_results_{job_id}{os.path.splitext(output_file)[1]}")
 
 @app.get("/jobs")
-async def list_jobs():
+def list_jobs():
     """List all active and completed jobs"""
     job_summaries = {}
-    for job_id, job_info in active_jobs.items():
+    for job_id, job_info in broker.list_jobs().items():
         job_summaries[job_id] = {
             "status": job_info["status"],
             "file_name": job_info.get("file_name", "Unknown"),
@@ -0,0 +1,127 @@
+import threading
+
+import pytest
+
+import job_queue
+from job_queue import SQLiteBroker, JobBroker, ROW_TASK, ASSEMBLE_TASK
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake time.time() for the queue so lease expiry doesn't depend on sleeping"""
+    now = [1000.0]
+    monkeypatch.setattr(job_queue.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def broker(tmp_path, clock):
+    return SQLiteBroker(str(tmp_path / "jobs.db"), max_attempts=2)
+
+
+def test_claims_rows_then_assemble(broker):
+    broker.create_job("j1", "a.xlsx", "xlsx", [{"Item Name": "x"}, {"Item Name": None}])
+    first = broker.claim("w1", 60)
+    second = broker.claim("w2", 60)
+    assert (first["kind"], first["row_index"], first["row"]) == (ROW_TASK, 0, {"Item Name": "x"})
+    assert second["row_index"] == 1
+    # Assemble task waits until every row is done
+    assert broker.claim("w3", 60) is None
+    assert broker.get_job("j1")["status"] == "processing"
+
+    assert broker.complete(first["task_id"], "w1", {"Title": "x"})
+    assert broker.complete(second["task_id"], "w2", None)
+    assert broker.get_job("j1")["processed"] == 2
+
+    assemble = broker.claim("w3", 60)
+    assert assemble["kind"] == ASSEMBLE_TASK
+    assert broker.job_results("j1") == [{"Title": "x"}, None]
+    assert broker.complete_job(assemble["task_id"], "w3", "/out.xlsx")
+    job = broker.list_jobs()["j1"]
+    assert (job["status"], job["output_file"]) == ("completed", "/out.xlsx")
+
+
+def test_expired_lease_is_reassigned_and_stale_complete_rejected(broker, clock):
+    broker.create_job("j1", "a.csv", "csv", [{"Item Name": "x"}])
+    task = broker.claim("w1", 60)
+    assert broker.claim("w2", 60) is None
+
+    clock[0] += 61
+    retry = broker.claim("w2", 60)
+    assert retry["task_id"] == task["task_id"]
+    assert not broker.heartbeat(task["task_id"], "w1", 60)
+    assert not broker.complete(task["task_id"], "w1", {"Title": "stale"})
+    assert broker.complete(retry["task_id"], "w2", {"Title": "fresh"})
+    assert broker.job_results("j1") == [{"Title": "fresh"}]
+
+
+def test_heartbeat_keeps_lease(broker, clock):
+    broker.create_job("j1", "a.csv", "csv", [{"Item Name": "x"}])
+    task = broker.claim("w1", 60)
+    clock[0] += 50
+    assert broker.heartbeat(task["task_id"], "w1", 60)
+    clock[0] += 50
+    assert broker.claim("w2", 60) is None
+
+
+def test_job_fails_after_max_attempts(broker, clock):
+    broker.create_job("j1", "a.csv", "csv", [{"Item Name": "x"}])
+    for worker_id in ("w1", "w2"):
+        assert broker.claim(worker_id, 60) is not None
+        clock[0] += 61
+    assert broker.claim("w3", 60) is None
+    job = broker.get_job("j1")
+    assert job["status"] == "failed"
+    assert "abandoned by 2 workers" in job["error"]
+
+
+def test_fail_marks_job_failed(broker):
+    broker.create_job("j1", "a.csv", "csv", [{"Item Name": "x"}, {"Item Name": "y"}])
+    task = broker.claim("w1", 60)
+    assert broker.fail(task["task_id"], "w1", "Row 1 failed: boom")
+    assert broker.get_job("j1")["error"] == "Row 1 failed: boom"
+    assert broker.claim("w2", 60) is None
+
+
+def test_concurrent_workers_never_share_a_task(tmp_path):
+    broker = SQLiteBroker(str(tmp_path / "jobs.db"))
+    broker.create_job("j1", "a.csv", "csv", [{"n": i} for i in range(30)])
+    claimed = []
+
+    def work(worker_id):
+        while True:
+            task = broker.claim(worker_id, 60)
+            if task is None:
+                return
+            claimed.append(task["task_id"])
+            if task["kind"] == ROW_TASK:
+                broker.complete(task["task_id"], worker_id, {})
+            else:
+                broker.complete_job(task["task_id"], worker_id, "out")
+
+    threads = [threading.Thread(target=work, args=(f"w{i}",)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(claimed) == len(set(claimed)) == 31
+    assert broker.get_job("j1")["status"] == "completed"
+
+
+def test_partial_broker_fails_at_construction():
+    class PartialBroker(JobBroker):
+        def claim(self, worker_id, lease_seconds):
+            return None
+
+    with pytest.raises(TypeError):
+        PartialBroker()
+
+
+def test_get_broker_reads_env(tmp_path, monkeypatch):
+    monkeypatch.delenv("JOB_BROKER", raising=False)
+    monkeypatch.setenv("JOB_QUEUE_DB", str(tmp_path / "jobs.db"))
+    monkeypatch.setenv("JOB_MAX_ATTEMPTS", "5")
+    broker = job_queue.get_broker()
+    assert isinstance(broker, SQLiteBroker)
+    assert broker.max_attempts == 5
@@ -0,0 +1,32 @@
+"""Standalone scraping worker.
+
+Start as many of these as there is browser capacity for. With the default SQLite queue they
+must run on the same host as the API (separate processes, or containers sharing a local
+volume as in docker-compose.yml); spreading workers over several nodes needs a JOB_BROKER
+backed by a network broker and an output directory every node can reach.
+
+    uvicorn main:app                          # API only enqueues and reports status
+    python worker.py --batch-size 5           # one or more workers do the scraping
+
+For single-process development, EMBEDDED_WORKER=1 uvicorn main:app runs a worker thread
+inside the API instead.
+"""
+import argparse
+
+from main import run_worker, LEASE_SECONDS
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process product scraping jobs from the shared queue")
+    parser.add_argument("--worker-id", default=None, help="Name reported in logs and leases (default: host-pid-random)")
+    parser.add_argument("--batch-size", type=int, default=5, help="Products scraped before a longer pause")
+    parser.add_argument("--lease-seconds", type=float, default=LEASE_SECONDS, help="How long a claimed row stays reserved without a heartbeat")
+    parser.add_argument("--poll-interval", type=float, default=5, help="Seconds to wait when the queue is empty")
+    args = parser.parse_args()
+
+    run_worker(
+        worker_id=args.worker_id,
+        batch_size=args.batch_size,
+        lease_seconds=args.lease_seconds,
+        poll_interval=args.poll_interval
+    )